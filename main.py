@@ -1,97 +1,174 @@
 import asyncio
-import json
+import random
 
+import orjson
 from aiogram import Bot, Dispatcher
 from aiogram.types import ParseMode
 from aiogram.utils import executor
+from aiogram.utils.exceptions import RetryAfter
+from eth_keys import keys
+from eth_utils import to_checksum_address
 from loguru import logger
 from web3 import Web3, HTTPProvider
+from web3.eth import AsyncEth
 
+from provider import SessionHTTPProvider
 from trader import Trader
 
 logger.add('app.log', format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}")
 
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    # uvloop isn't available on Windows, default asyncio loop is used there
+    pass
+
 bot: Bot
 dp: Dispatcher
 
 web3: Web3
+async_web3: Web3
 trader: Trader
 TX_URL: str
 
 accounts = []
 channel_id: int
+# Telegram messages are sent by telegram_sender, so trading doesn't wait for Telegram API
+msg_queue = asyncio.Queue()
 
 INTERVAL: int
+GAS_ESTIMATE_REFRESH_CYCLES: int
 
 
 def load_config():
     logger.info('Loading config...')
-    with open('config.json') as f:
-        return json.load(f)
+    with open('config.json', 'rb') as f:
+        return orjson.loads(f.read())
 
 
 def load_accounts():
     """Load ethereum wallets private keys from keys.txt file for making swaps"""
     logger.info('Loading accounts...')
-    with open('keys.txt') as f:
-        for key in f:
-            key = key.strip()
-            address = web3.eth.account.from_key(key).address
-            accounts.append((address, key))
+    with open('keys.txt', 'rb') as f:
+        raw_keys = f.read().split()
+    # eth_keys uses libsecp256k1 via coincurve if it is installed, which is much faster than LocalAccount creation
+    for key in map(bytes.decode, raw_keys):
+        private_key = keys.PrivateKey(bytes.fromhex(key.removeprefix('0x')))
+        accounts.append((to_checksum_address(private_key.public_key.to_address()), key))
 
 
 async def boost_volume():
     logger.info('Volume Booster Start...')
+    cycle = 0
+    backoff = 1
+    while True:
+        if cycle % GAS_ESTIMATE_REFRESH_CYCLES == 0:
+            trader.reset_gas_estimates()
+        cycle += 1
+        try:
+            balances = await trader.get_balances([address for address, _ in accounts])
+        except Exception as e:
+            # Node is unavailable or throttles us, so wait longer before each next try
+            logger.exception(f'[ERROR] while getting balances, retry in {backoff} secs: {e}')
+            await asyncio.sleep(backoff)
+            backoff = min(30, backoff * 2)
+            continue
+        backoff = 1
+        # Buys of the cycle and their estimates share one deadline, sells build their own after approve
+        deadline = trader.deadline()
+        results = await asyncio.gather(
+            *(handle_account(account, *balances[account[0]], deadline) for account in accounts),
+            return_exceptions=True
+        )
+        for account, result in zip(accounts, results):
+            if isinstance(result, Exception):
+                logger.opt(exception=result).error(f'[ERROR] while handling {account[0]}: {result}')
+        await asyncio.sleep(INTERVAL)
+
+
+async def handle_account(account, bnb, tokens_amount, deadline):
+    """Make one buy/sell round using the given wallet and its balances at the cycle start"""
+    address, key = account
+    # Spread wallets over the cycle, so they don't hit the node with the same burst of requests
+    await asyncio.sleep(random.uniform(0, INTERVAL * 0.3))
+    can_buy, *fee = await trader.can_buy(bnb, address, deadline) if bnb > 0 else (False,)
+    if can_buy:
+        # Gas estimated by can_buy is reused for the buy
+        result = await trader.buy(address, key, bnb, deadline, prebuilt_fee=tuple(fee))
+        if result:
+            msg_queue.put_nowait((channel_id,
+                                  f'Bought {result["amount"]} {trader.symbol} tokens with {result["bnb"]} BNB\n{TX_URL % result["tx"]}'))
+        await asyncio.sleep(10)
+        tokens_amount = await trader.get_token_balance(address)
+    if tokens_amount > 0:
+        result = await trader.sell(address, key, tokens_amount)
+        if result:
+            msg_queue.put_nowait((channel_id,
+                                  f'Sold {result["amount"]} {trader.symbol} tokens for {result["bnb"]} BNB\n{TX_URL % result["tx"]}'))
+    # logger.error(f"Account {address} can't buy and sell\nBNB: {bnb}\nTokens amount:{tokens_amount}")
+    # await bot.send_message(channel_id,
+    #                        f"Account {address} can't buy and sell\nBNB balance: {trader.wei_to_eth(bnb)}\nTokens balance:{tokens_amount / trader.decimals}")
+
+
+async def telegram_sender():
+    """Send queued messages one by one, staying under Telegram rate limits"""
     while True:
-        for account in accounts:
-            address, key = account
-            bnb = trader.get_bnb_balance(address)
-            if bnb > 0 and trader.can_buy(bnb, wallet=address):
-                result = trader.buy(address, key, bnb)
-                await bot.send_message(channel_id,
-                                       f'Bought {result["amount"]} {trader.symbol} tokens with {result["bnb"]} BNB\n{TX_URL % result["tx"]}')
-                await asyncio.sleep(10)
-            tokens_amount = trader.get_token_balance(address)
-            if tokens_amount > 0:
-                result = trader.sell(address, key, tokens_amount)
-                await bot.send_message(channel_id,
-                                       f'Sold {result["amount"]} {trader.symbol} tokens for {result["bnb"]} BNB\n{TX_URL % result["tx"]}')
-            # logger.error(f"Account {address} can't buy and sell\nBNB: {bnb}\nTokens amount:{tokens_amount}")
-            # await bot.send_message(channel_id,
-            #                        f"Account {address} can't buy and sell\nBNB balance: {trader.wei_to_eth(bnb)}\nTokens balance:{tokens_amount / trader.decimals}")
-            await asyncio.sleep(INTERVAL)
+        chat_id, text = await msg_queue.get()
+        try:
+            await bot.send_message(chat_id, text)
+        except RetryAfter as e:
+            logger.warning(f'Telegram flood control, retry in {e.timeout} secs')
+            await asyncio.sleep(e.timeout)
+            msg_queue.put_nowait((chat_id, text))
+        except Exception as e:
+            logger.exception(f'[ERROR] while sending message to Telegram: {e}')
+        await asyncio.sleep(0.05)
 
 
 def init():
-    global bot, dp, web3, trader, TX_URL, INTERVAL, channel_id
+    global bot, dp, web3, async_web3, trader, TX_URL, INTERVAL, GAS_ESTIMATE_REFRESH_CYCLES, channel_id
     config = load_config()
-    web3 = Web3(HTTPProvider(config['bscNode']))
+    web3 = Web3(HTTPProvider(config['bscNode'], request_kwargs={'timeout': config['requestTimeoutInSeconds']}))
+    async_web3 = Web3(SessionHTTPProvider(config['bscNode'], batch_size=config['batchSize'],
+                                          timeout=config['requestTimeoutInSeconds'],
+                                          max_connections=config['maxConnections']),
+                      modules={'eth': (AsyncEth,)}, middlewares=[])
     TX_URL = config['txUrl']
     channel_id = config['channelId']
     INTERVAL = config['intervalInSeconds']
+    GAS_ESTIMATE_REFRESH_CYCLES = config['gasEstimateRefreshCycles']
 
-    router_abi = json.loads(config['pancakeswapRouterABI'])
+    router_abi = orjson.loads(config['pancakeswapRouterABI'])
     router_address = Web3.toChecksumAddress(config['pancakeSwapRouterAddress'])
 
     logger.info(f'Connected: {web3.isConnected()}')
     logger.info(f'Chain ID: {web3.eth.chainId}')
 
     token_address = Web3.toChecksumAddress(config['tokenAddress'])
-    token_abi = json.loads(config['tokenABI'])
+    token_abi = orjson.loads(config['tokenABI'])
     token_contract = web3.eth.contract(address=token_address, abi=token_abi)
 
     bot = Bot(token=config['telegramBotToken'], parse_mode=ParseMode.HTML)
     dp = Dispatcher(bot)
     load_accounts()
-    trader = Trader(web3, router_address, router_abi, token_contract, token_address)
+    trader = Trader(web3, async_web3, router_address, router_abi, token_contract, token_address,
+                    gas_price_ttl=config['gasPriceTtlInSeconds'])
 
 
 async def on_bot_start_up(dispatcher) -> None:
     """List of actions which should be done before bot start"""
     logger.info('Start up')
+    asyncio.create_task(telegram_sender())
     asyncio.create_task(boost_volume())
 
 
+async def on_bot_shutdown(dispatcher) -> None:
+    """List of actions which should be done on bot shutdown"""
+    logger.info('Shutdown')
+    await async_web3.provider.close()
+
+
 if __name__ == '__main__':
     init()
-    executor.start_polling(dp, skip_updates=True, on_startup=on_bot_start_up)
+    executor.start_polling(dp, skip_updates=True, on_startup=on_bot_start_up, on_shutdown=on_bot_shutdown)
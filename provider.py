@@ -0,0 +1,109 @@
+import asyncio
+from typing import Any, List, Optional, Sequence, Tuple
+
+import orjson
+from aiohttp import ClientResponseError, ClientSession, ClientTimeout, TCPConnector
+from loguru import logger
+from web3 import AsyncHTTPProvider
+from web3.types import RPCEndpoint, RPCResponse
+
+
+def _json_default(obj: Any) -> Any:
+    if isinstance(obj, (bytes, bytearray)):
+        return '0x' + obj.hex()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+# Node throttling and gateway errors. Gateway may fail after the node has processed the request,
+# so only idempotent requests are retried, transactions submission is not
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class SessionHTTPProvider(AsyncHTTPProvider):
+    """Async HTTP provider which reuses one aiohttp session for all requests.
+
+    web3's AsyncHTTPProvider opens a new ClientSession (and connection) per request, here connections
+    are kept alive and shared by all concurrent requests, so TLS handshake is made once per connection.
+    Requests and responses are (de)serialized with orjson instead of stdlib json.
+    """
+
+    def __init__(self, endpoint_uri: str, request_kwargs: Optional[Any] = None, batch_size: int = 25,
+                 timeout: float = 30, max_connections: int = 32, max_retries: int = 5):
+        super().__init__(endpoint_uri, request_kwargs)
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self._session: Optional[ClientSession] = None
+
+    def _get_session(self) -> ClientSession:
+        # Session must be created inside the running event loop, so do it lazily
+        if self._session is None or self._session.closed:
+            connector = TCPConnector(limit=self.max_connections, keepalive_timeout=60, ttl_dns_cache=300)
+            self._session = ClientSession(connector=connector, raise_for_status=True,
+                                          timeout=ClientTimeout(self.timeout))
+        return self._session
+
+    async def _post(self, data: bytes, retry: bool = True) -> bytes:
+        """Post data to node, retrying throttled requests with exponential backoff if retry is set."""
+        backoff = 1
+        for attempt in range(self.max_retries + 1 if retry else 1):
+            try:
+                async with self._get_session().post(self.endpoint_uri, data=data,
+                                                    **self.get_request_kwargs()) as response:
+                    return await response.read()
+            except ClientResponseError as e:
+                if not retry or e.status not in RETRY_STATUSES or attempt == self.max_retries:
+                    raise
+                logger.warning(f'Node responded {e.status}, retry in {backoff} secs')
+                await asyncio.sleep(backoff)
+                backoff = min(30, backoff * 2)
+
+    async def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        raw_response = await self._post(self.encode_rpc_request(method, params))
+        return self.decode_rpc_response(raw_response)
+
+    async def make_batch_request(self, requests: Sequence[Tuple[RPCEndpoint, Any]],
+                                 retry: bool = True) -> List[RPCResponse]:
+        """Send requests as JSON-RPC batches of at most batch_size and return responses in the same order.
+
+        Set retry to False for non-idempotent requests like eth_sendRawTransaction.
+        """
+        responses = []
+        # Batches are sent one after another, so the node doesn't throttle a burst of large requests
+        for i in range(0, len(requests), self.batch_size):
+            batch = [self._rpc_dict(method, params) for method, params in requests[i:i + self.batch_size]]
+            responses.extend(await self._make_batch(batch, retry))
+        return responses
+
+    async def _make_batch(self, batch: List[dict], retry: bool) -> List[RPCResponse]:
+        raw_response = await self._post(orjson.dumps(batch, default=_json_default), retry)
+        response = self.decode_rpc_response(raw_response)
+        # Node returns single error object if it rejects the whole batch
+        if not isinstance(response, list):
+            raise ValueError(response.get('error'))
+        # Batch responses may come in any order, so they are matched to requests by id. A missing response
+        # or one with null id (e.g. invalid request) can't be matched, so the whole batch is failed
+        by_id = {r.get('id'): r for r in response}
+        ids = [request['id'] for request in batch]
+        if len(response) != len(batch) or by_id.keys() != set(ids):
+            raise ValueError(f'Batch response ids {sorted(by_id, key=str)} do not match request ids {ids}')
+        return [by_id[i] for i in ids]
+
+    def encode_rpc_request(self, method: RPCEndpoint, params: Any) -> bytes:
+        return orjson.dumps(self._rpc_dict(method, params), default=_json_default)
+
+    def decode_rpc_response(self, raw_response: bytes) -> RPCResponse:
+        return orjson.loads(raw_response)
+
+    def _rpc_dict(self, method: RPCEndpoint, params: Any) -> dict:
+        return {
+            'jsonrpc': '2.0',
+            'method': method,
+            'params': params or [],
+            'id': next(self.request_counter),
+        }
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()